@@ -0,0 +1,86 @@
+import os
+import hashlib
+import tempfile
+import subprocess
+
+import casadi as ca
+
+
+# directory of the generated and compiled NLP code
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build')
+
+# compiler flags of the generated code, the generated functions run as fast
+# with -Os as with -O3, but compile about a third faster
+default_flags = ('-Os', '-march=native')
+
+
+def compile_cached(generate, name: str, flags=default_flags) -> str:
+    '''
+        Generates C code with generate(filename) and compiles it into a
+        shared library in cache_dir. generate is the code generator of a
+        CasADi solver (generate_dependencies), which only accepts a file
+        name and writes the file into the current working directory.
+
+        The library is named after a hash of the code and the flags, so it
+        is only compiled if one of them changed. The libraries of older
+        code with the same name are removed. Returns the path of the
+        library.
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # generate into a private directory, so that several processes (e.g. the
+    # 2D and the 3D script) never share the generated file and the working
+    # directory does not have to be writable
+    with tempfile.TemporaryDirectory(dir=cache_dir) as directory:
+        working_directory = os.getcwd()
+        os.chdir(directory)
+        try:
+            c_file = os.path.abspath(generate(name + '.c'))
+        finally:
+            os.chdir(working_directory)
+
+        with open(c_file, 'rb') as file:
+            code = file.read()
+
+        digest = hashlib.sha1(code + ' '.join(flags).encode()).hexdigest()[:16]
+        library = os.path.join(cache_dir, f'{name}_{digest}.so')
+
+        if not os.path.exists(library):
+            # compile to a private file first and move it into place, so that
+            # an interrupted or concurrent build never leaves a broken
+            # library behind
+            subprocess.run(['gcc', *flags, '-shared', '-fPIC', c_file,
+                            '-o', os.path.join(directory, name + '.so')],
+                           check=True)
+            os.replace(c_file, os.path.join(cache_dir,
+                                            f'{name}_{digest}.c'))
+            os.replace(os.path.join(directory, name + '.so'), library)
+
+            # only the latest library of each name is kept, the ones of
+            # older code are never loaded again
+            for file_name in os.listdir(cache_dir):
+                stem, extension = os.path.splitext(file_name)
+                if (extension in ('.c', '.so')
+                        and stem.rpartition('_')[0] == name
+                        and stem != f'{name}_{digest}'):
+                    os.remove(os.path.join(cache_dir, file_name))
+
+    return library
+
+
+def cached_nlpsol(name: str, solver: str, nlp: dict, options: dict,
+                  flags=default_flags) -> ca.Function:
+    '''
+        Creates the same solver as ca.nlpsol(name, solver, nlp, options),
+        but the NLP functions (objective, constraints and their derivatives)
+        are compiled ahead of time instead of being evaluated by the CasADi
+        virtual machine. Later runs with the same NLP reuse the library.
+    '''
+    generator = ca.nlpsol(name, solver, nlp, options)
+    library = compile_cached(generator.generate_dependencies, name, flags)
+
+    # the compiled functions are already expanded
+    options = {key: value for key, value in options.items()
+               if key != 'expand'}
+
+    return ca.nlpsol(name, solver, library, options)
@@ -0,0 +1,148 @@
+import numpy as np
+import casadi as ca
+
+
+class CasadiProblem:
+    '''
+        Callbacks of the NLP
+
+            min f(x)  s.t.  lbg <= g(x) <= ubg,  lbx <= x <= ubx
+
+        for the cyipopt interface of IPOPT. CasADi only evaluates the
+        structural nonzeros of the constraint jacobian and the lower
+        triangle of the hessian of the lagrangian, the (constant) sparsity
+        patterns are computed once and handed to IPOPT directly. Rows of g
+        which are linear in x have a constant jacobian, it is evaluated once
+        and only the nonlinear rows are differentiated in every iteration.
+    '''
+
+    def __init__(self, nlp: dict, exact_hessian: bool = True):
+        variables = nlp['x']
+        cost = nlp['f']
+        constraints = nlp['g']
+
+        self.n_variables = variables.shape[0]
+        self.n_constraints = constraints.shape[0]
+
+        # split the rows of g by whether they depend nonlinearly on x
+        nonlinear = ca.which_depends(constraints, variables, 2, True)
+        rows_nonlinear = np.flatnonzero(nonlinear)
+        rows_linear = np.flatnonzero(np.logical_not(nonlinear))
+
+        jacobian = ca.jacobian(constraints[rows_nonlinear.tolist()],
+                               variables)
+        jacobian_linear = ca.jacobian(constraints[rows_linear.tolist()],
+                                      variables)
+
+        # the triplets refer to the rows of the full g, the nonzeros of the
+        # nonlinear rows come first
+        rows, columns = jacobian.sparsity().get_triplet()
+        rows_lin, columns_lin = jacobian_linear.sparsity().get_triplet()
+        self._jacobian_structure = (
+            np.concatenate((rows_nonlinear[rows],
+                            rows_linear[rows_lin])).astype(int),
+            np.concatenate((columns, columns_lin)).astype(int),
+        )
+
+        self._cost = ca.Function('f', [variables], [cost]).expand()
+        self._gradient = ca.Function(
+            'grad_f', [variables], [ca.gradient(cost, variables)]
+        ).expand()
+        self._constraints = ca.Function(
+            'g', [variables], [constraints]
+        ).expand()
+        self._jacobian = ca.Function(
+            'jac_g', [variables], [jacobian]
+        ).expand()
+        self._jacobian_linear = np.array(ca.Function(
+            'jac_g_lin', [variables], [jacobian_linear]
+        ).expand()(np.zeros(self.n_variables)).nonzeros())
+
+        # with a limited-memory approximation IPOPT never evaluates the hessian
+        self._hessian = None
+        self._hessian_structure = ([], [])
+
+        if exact_hessian:
+            # hessian of the lagrangian obj_factor * f + lam^T g, IPOPT only
+            # expects its lower triangle
+            obj_factor = type(variables).sym('obj_factor')
+            lagrange = type(variables).sym('lam_g', self.n_constraints)
+            hessian, _ = ca.hessian(obj_factor * cost
+                                    + ca.dot(lagrange, constraints),
+                                    variables)
+            hessian = ca.tril(hessian)
+
+            self._hessian_structure = hessian.sparsity().get_triplet()
+            self._hessian = ca.Function(
+                'hess_l', [variables, lagrange, obj_factor], [hessian]
+            ).expand()
+
+    def objective(self, x):
+        return float(self._cost(x))
+
+    def gradient(self, x):
+        return self._gradient(x).full().ravel()
+
+    def constraints(self, x):
+        return self._constraints(x).full().ravel()
+
+    def jacobianstructure(self):
+        return self._jacobian_structure
+
+    def jacobian(self, x):
+        return np.concatenate((np.array(self._jacobian(x).nonzeros()),
+                               self._jacobian_linear))
+
+    def hessianstructure(self):
+        return self._hessian_structure
+
+    def hessian(self, x, lagrange, obj_factor):
+        return np.array(self._hessian(x, lagrange, obj_factor).nonzeros())
+
+
+def solve(nlp: dict, x0, lbx, ubx, lbg, ubg, ipopt_options: dict,
+          lam_g0=0, lam_x0=0) -> dict:
+    '''
+        Solves the NLP with IPOPT through cyipopt. The arguments correspond
+        to those of a CasADi nlpsol solver, ipopt_options are passed to
+        IPOPT unchanged. Returns x, f, lam_g and lam_x like nlpsol does and
+        whether IPOPT converged (success).
+    '''
+    # cyipopt is only needed for this solver backend
+    import cyipopt
+
+    exact_hessian = (ipopt_options.get('hessian_approximation', 'exact')
+                     == 'exact')
+    problem = CasadiProblem(nlp, exact_hessian)
+
+    ipopt = cyipopt.Problem(
+        n=problem.n_variables,
+        m=problem.n_constraints,
+        problem_obj=problem,
+        lb=np.broadcast_to(lbx, problem.n_variables),
+        ub=np.broadcast_to(ubx, problem.n_variables),
+        cl=np.broadcast_to(lbg, problem.n_constraints),
+        cu=np.broadcast_to(ubg, problem.n_constraints),
+    )
+
+    for option, value in ipopt_options.items():
+        ipopt.add_option(option, value)
+
+    # the multipliers of the variable bounds are split by sign into those of
+    # the lower and the upper bounds
+    lam_x0 = np.broadcast_to(lam_x0, problem.n_variables)
+    x, info = ipopt.solve(
+        np.asarray(x0, dtype=float),
+        lagrange=np.broadcast_to(lam_g0, problem.n_constraints),
+        zl=np.maximum(-lam_x0, 0),
+        zu=np.maximum(lam_x0, 0),
+    )
+
+    return {
+        'x': ca.DM(x),
+        'f': ca.DM(info['obj_val']),
+        'lam_g': ca.DM(info['mult_g']),
+        'lam_x': ca.DM(info['mult_x_U'] - info['mult_x_L']),
+        # solved to the desired or to the acceptable tolerance
+        'success': info['status'] in (0, 1),
+    }
@@ -0,0 +1,251 @@
+import os
+import hashlib
+
+import numpy as np
+import casadi as ca
+
+from functools import lru_cache
+from math import sin, cos, sqrt
+from ctypes.util import find_library
+
+from numba import njit
+
+# Gravitational constant
+grav_const = 0.0008
+
+# masses of the simulated bodies
+sun_mass = 1000000
+rocket_mass = 0.05
+
+# rocket is always body_0, planet is always body_-1
+body_masses = (rocket_mass, sun_mass)
+
+# number of bodies in orbit
+n_body = 1
+
+# radius of the planet
+surface = 100
+
+# desired circular orbit height
+orbit = 190
+
+
+def linear_solver(n_variables: int) -> str:
+    '''
+        The linear solver IPOPT uses for the KKT systems. The HSL solvers
+        are much faster than MUMPS on the banded systems of the shooting
+        NLPs, MA27 for small problems, MA57 for medium and MA86 for large
+        ones. Falls back to MUMPS if IPOPT cannot load the HSL library.
+    '''
+    if not find_library('hsl'):
+        return 'mumps'
+    if n_variables < 1000:
+        return 'ma27'
+    if n_variables < 100000:
+        return 'ma57'
+    return 'ma86'
+
+
+def problem_digest(nlp: dict, lbx, ubx, lbg, ubg) -> str:
+    '''
+        A hash of the NLP functions and of the bounds, which identifies the
+        problem a warm start belongs to. Every constant of the problem
+        (e.g. the step size, the orbit or the initial value) enters either
+        the functions or the bounds.
+    '''
+    functions = ca.Function('nlp', [nlp['x']], [nlp['f'], nlp['g']])
+
+    digest = hashlib.sha1(functions.serialize().encode())
+    for bounds in (lbx, ubx, lbg, ubg):
+        digest.update(np.ascontiguousarray(bounds, dtype=float).tobytes())
+    return digest.hexdigest()
+
+
+def load_warm_start(filename: str, problem: str):
+    '''
+        Loads the primal and dual solution (x, lam_g and lam_x) of a previous
+        solve stored by save_warm_start. Returns None if there is no such
+        file or if it belongs to a different problem (see problem_digest).
+    '''
+    if not os.path.exists(filename):
+        return None
+
+    with np.load(filename) as data:
+        if str(data['problem']) != problem:
+            return None
+        return {key: data[key] for key in ('x', 'lam_g', 'lam_x')}
+
+
+def save_warm_start(filename: str, result: dict, problem: str):
+    '''
+        Stores x, lam_g and lam_x of a solver result for load_warm_start,
+        together with the digest of the problem it solves.
+    '''
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    np.savez(filename, problem=problem,
+             **{key: result[key].full().ravel()
+                for key in ('x', 'lam_g', 'lam_x')})
+
+
+def rk4step_u(ode, h, x, u):
+    """ one step of explicit Runge-Kutta scheme of order four (RK4)
+
+    parameters:
+    ode -- odinary differential equations (your system dynamics)
+    h -- step of integration
+    x -- states
+    u -- controls
+    """
+    k1 = ode(x, u)
+    k2 = ode(x + h * 0.5 * k1, u)
+    k3 = ode(x + h * 0.5 * k2, u)
+    k4 = ode(x + h * k3, u)
+    return x + ((h / 6) * (k1 + 2 * k2 + 2 * k3 + k4))
+
+
+def ode_general(z, controls, body_masses: tuple, n_body: int, dimension: int):
+    '''
+        The right hand side of
+            z' = f(z, u)
+
+        where u are controls (alpha, theta, r) for body_1 ie.
+        (alpha, theta) specifies the rocket direction and r the thrust.
+        In two dimensions the controls are (r, phi), in three dimensions
+        (r, phi, theta).
+    '''
+    # positions of the movable bodies as columns of a (dimension, n_body)
+    # matrix, followed by their velocities in z
+    body_positions = ca.reshape(z[0:n_body * dimension], dimension, n_body)
+    body_velocities = z[n_body * dimension:2 * n_body * dimension]
+
+    # the planet is body_n_body, fixed at the origin, so that its force is
+    # computed by the same pairwise kernel as the forces between the bodies
+    positions = ca.horzcat(body_positions, ca.DM.zeros(dimension, 1))
+
+    # calculate the force of body_j on body_i, no force of a body on itself
+    # and none on the planet
+    pairs = [(i, j) for i in range(n_body) for j in range(n_body + 1)
+             if i != j]
+    index_i = [i for i, _ in pairs]
+    index_j = [j for _, j in pairs]
+
+    # the inverse cubed distances are computed once per pair and multiplied
+    pair_differences = positions[:, index_j] - positions[:, index_i]
+    pair_distances_squared = ca.sum1(pair_differences ** 2)
+    pair_weights = (grav_const * ca.DM([body_masses[j] for j in index_j]).T
+                    / (pair_distances_squared
+                       * ca.sqrt(pair_distances_squared)))
+
+    # sum up the pairwise forces acting on each body_i
+    pair_to_body = ca.DM.zeros(len(pairs), n_body)
+    for k, i in enumerate(index_i):
+        pair_to_body[k, i] = 1
+
+    rhs_acceleration = ca.mtimes(
+        pair_differences * ca.repmat(pair_weights, dimension, 1),
+        pair_to_body
+    )
+
+    # body_0 is the actuated rocket, add control force, the sine and cosine
+    # of each angle are evaluated once
+    r = controls[0]
+    phi = controls[1]
+
+    if dimension == 2:
+        thrust_direction = ca.vertcat(ca.cos(phi), ca.sin(phi))
+    else:
+        theta = controls[2]
+        sin_phi = ca.sin(phi)
+        thrust_direction = ca.vertcat(sin_phi * ca.cos(theta),
+                                      sin_phi * ca.sin(theta),
+                                      ca.cos(phi))
+
+    rhs_acceleration[:, 0] += r * thrust_direction / body_masses[0]
+
+    return ca.vertcat(body_velocities, ca.vec(rhs_acceleration))
+
+
+@lru_cache
+def make_ode(dimension: int, n_body: int, body_masses: tuple) -> ca.Function:
+    '''
+        The right hand side of the ODE as a function f(x, u), built once per
+        dimension, number of bodies and body masses.
+    '''
+    x_single = ca.SX.sym('x', 2 * n_body * dimension)
+    u_single = ca.SX.sym('u', dimension)
+
+    return ca.Function('f', [x_single, u_single], [
+        ode_general(x_single, u_single, body_masses, n_body, dimension)
+    ])
+
+
+@lru_cache
+def make_dynamics(dimension: int, n_body: int,
+                  body_masses: tuple) -> ca.Function:
+    '''
+        The dynamics d(x, u, h) using the RK4-integrator, built once per
+        dimension, number of bodies and body masses.
+    '''
+    x_single = ca.SX.sym('x', 2 * n_body * dimension)
+    u_single = ca.SX.sym('u', dimension)
+    step_h = ca.SX.sym('h')
+
+    def ode(z, controls):
+        # fix the body data
+        return ode_general(z, controls, body_masses, n_body, dimension)
+
+    return ca.Function('d', [x_single, u_single, step_h], [rk4step_u(
+        ode, step_h, x_single, u_single
+    )])
+
+
+@njit(cache=True, fastmath=True)
+def ode_np(z, controls):
+    '''
+        Numerical right hand side of z' = f(z, u) for the single rocket
+        orbiting the planet. Matches ode_general for n_body = 1 in two or
+        three dimensions and is used to simulate the initial guess.
+    '''
+    dimension = controls.shape[0]
+    r2 = 0.0
+    for d in range(dimension):
+        r2 += z[d] ** 2
+    inv_r3 = 1 / (r2 * sqrt(r2))
+
+    rhs = np.empty(2 * dimension)
+    for d in range(dimension):
+        rhs[d] = z[dimension + d]
+        rhs[dimension + d] = -grav_const * body_masses[-1] * z[d] * inv_r3
+
+    thrust = controls[0] / body_masses[0]
+    if dimension == 2:
+        rhs[2] += thrust * cos(controls[1])
+        rhs[3] += thrust * sin(controls[1])
+    else:
+        thrust_sin_phi = thrust * sin(controls[1])
+        rhs[3] += thrust_sin_phi * cos(controls[2])
+        rhs[4] += thrust_sin_phi * sin(controls[2])
+        rhs[5] += thrust * cos(controls[1])
+    return rhs
+
+
+@njit(cache=True, fastmath=True)
+def rk4step_np(z, controls, h):
+    '''
+        One RK4 step of ode_np, the numerical counterpart of dynamics.
+    '''
+    k1 = ode_np(z, controls)
+    k2 = ode_np(z + h * 0.5 * k1, controls)
+    k3 = ode_np(z + h * 0.5 * k2, controls)
+    k4 = ode_np(z + h * k3, controls)
+    return z + ((h / 6) * (k1 + 2 * k2 + 2 * k3 + k4))
+
+
+@njit(cache=True)
+def rollout_np(trajectory, controls, h):
+    '''
+        Simulates the dynamics from the state trajectory[0] with the
+        controls[i] on step i and writes the states into trajectory[1:].
+    '''
+    for i in range(controls.shape[0]):
+        trajectory[i + 1] = rk4step_np(trajectory[i], controls[i], h)
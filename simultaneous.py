@@ -1,7 +1,15 @@
+import os
+
 import numpy as np
 import casadi as ca
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+
+import codegen
+import cyipopt_nlp
+
+from shared import (grav_const, sun_mass, body_masses, n_body, surface,
+                    orbit, make_dynamics, make_ode, rollout_np,
+                    linear_solver, problem_digest, load_warm_start,
+                    save_warm_start)
 
 from math import pi, sin, cos, sqrt
 
@@ -14,133 +22,49 @@ N = 176
 # Stepsize
 h = T / (N - 1)
 
-# Gravitational constant
-grav_const = 0.0008
-
-# masses of the simulated bodies
-sun_mass = 1000000
-rocket_mass = 0.05
-
-# rocket is always body_0, planet is always body_-1
-body_masses = (rocket_mass, sun_mass)
-
-# number of bodies in orbit
-n_body = 1
-
 # dimension to simulate in
 dimension = 2
 
 # maximum thrust of the rocket
 thrust_max = 0.0003
 
-# radius of the planet
-surface = 100
-
 # initial position and velocity of orbiting body
 v_initial = 2.412
 
 x_0_bar = [surface * 1.1, 0, v_initial * cos(pi/4), v_initial * sin(pi/4)]
 
-# desired circular orbit height
-orbit = 190
-
-
-def rk4step_u(ode, h, x, u):
-    """ one step of explicit Runge-Kutta scheme of order four (RK4)
-
-    parameters:
-    ode -- odinary differential equations (your system dynamics)
-    h -- step of integration
-    x -- states
-    u -- controls
-    """
-    k1 = ode(x, u)
-    k2 = ode(x + h * 0.5 * k1, u)
-    k3 = ode(x + h * 0.5 * k2, u)
-    k4 = ode(x + h * k3, u)
-    return x + ((h / 6) * (k1 + 2 * k2 + 2 * k3 + k4))
-
-
-def ode_general(z, controls, body_masses: tuple, n_body: int, dimension: int):
-    '''
-        The right hand side of
-            z' = f(z, u)
-
-        where u are controls (alpha, theta, r) for body_1 ie.
-        (alpha, theta) specifies the rocket direction and r the thrust.
-    '''
-    rhs_velocity = []
-    rhs_acceleration = []
-
-    # iterate on all movable bodies around the planet
-    for i in range(0, n_body):
-
-        body_velocity_i = z[n_body * dimension + (i * dimension):
-                            n_body * dimension + ((i + 1) * dimension)]
-
-        rhs_velocity = ca.vertcat(rhs_velocity, body_velocity_i)
-
-        rhs_acceleration_i = 0
-
-        # calculate the force of body_j on body_i (in case there is more
-        # than one body in orbit)
-        for j in range(0, n_body):
-            # no force of a body on itself
-            if i == j:
-                continue
-
-            body_position_i = z[(i * dimension): ((i + 1) * dimension)]
-            body_position_j = z[(j * dimension): ((j + 1) * dimension)]
-
-            rhs_acceleration_i += (grav_const * body_masses[j]
-                                   / (ca.norm_2(body_position_i
-                                                - body_position_j) ** 3)
-                                   * (body_position_j - body_position_i))
-
-        # calculate the force of the planet on body_i
-        body_position_i = z[(i * dimension): ((i + 1) * dimension)]
-        planet_position = [0] * dimension
-
-        rhs_acceleration_i += (grav_const * body_masses[-1]
-                               / (ca.norm_2(body_position_i
-                                            - planet_position) ** 3)
-                               * (planet_position - body_position_i))
-
-        # body_0 is the actuated rocket, add control force
-        if i == 0:
-            r = controls[0]
-            phi = controls[1]
-            rhs_acceleration_i[0] += r * ca.cos(phi) / body_masses[i]
-            rhs_acceleration_i[1] += r * ca.sin(phi) / body_masses[i]
-
-        rhs_acceleration = ca.vertcat(rhs_acceleration, rhs_acceleration_i)
-
-    return ca.vertcat(rhs_velocity, rhs_acceleration)
 
+state_dimension = 2 * n_body * dimension
 
-def ode(z, controls):
-    # fix the body data defined above
-    return ode_general(z, controls, body_masses, n_body, dimension)
+# define the dynamics using the RK4-integrator, the functions are built once
+# in shared.py and reused by both scripts
+dynamics = make_dynamics(dimension, n_body, body_masses)
 
+# evaluate the dynamics on all N shooting intervals in a single call
+dynamics_map = dynamics.map(N, 'serial')
 
-state_dimension = 2 * n_body * dimension
+# the same for the right hand side of the ODE, used for lifted RK4 stages
+ode_map = make_ode(dimension, n_body, body_masses).map(N, 'serial')
 
+# lift the four RK4 stages of every interval to decision variables, which
+# gives a larger but sparser NLP. IPOPT converges on it as well, but with
+# MUMPS the solve takes about twice as long, so it is switched off by default
+lifted_rk4 = False
 
-x_single = ca.SX.sym('x', state_dimension)
-u_single = ca.SX.sym('u', dimension)
-step_h = ca.SX.sym('h')
+# number of lifted stage variables
+n_stages = 4 * N * state_dimension if lifted_rk4 else 0
 
 
-# define the dynamics using the RK4-integrator
-dynamics = ca.Function('d', [x_single, u_single, step_h], [rk4step_u(
-    ode, step_h, x_single, u_single
-)])
-
+# the NLP is built from MX symbols so that the SX dynamics enter the graph as
+# opaque function calls instead of being expanded into scalar expressions
 
 # N+1 states, position and velocity, n_body bodies, dimenstion dimensions
-x = ca.SX.sym('x', (N + 1) * state_dimension)
+x = ca.MX.sym('x', (N + 1) * state_dimension)
 # N states, thrust and dimension-1 angles
-u = ca.SX.sym('u', N * dimension)
+u = ca.MX.sym('u', N * dimension)
+# N intervals, four RK4 stages k1, ..., k4 of dimension state_dimension each
+# (if lifted_rk4)
+k = ca.MX.sym('k', n_stages)
 
 
 # define the orbital velocity
@@ -159,268 +83,382 @@ def cost_function_integral_discrete(x, u):
         Computes the discretized cost of given state and control variables to
         be minimized as a finite Riemann sum. Corresponds to eqn. (25).
     '''
-    cost = 0
-    for i in range(N):
-        cost += h * u[dimension * i]
-    return cost
+    return h * ca.sum1(u[0::dimension])
 
 
 # build nlp
 constraints = []
-lbg = []
-ubg = []
 
-# constraint: x_0 = x_0_bar (eqn. (27))
-constraints.append(x[0:state_dimension] - x_0_bar)
-lbg += [0] * state_dimension
-ubg += [0] * state_dimension
-
-for i in range(0, N):
-    constraints.append(
-        # contraint: x_k+1 - F(x_k, u_k) (eqn. (26))
-        x[(i+1) * state_dimension:(i+2) * state_dimension] - dynamics(
-            x[i * state_dimension:(i+1) * state_dimension],
-            u[dimension * i:dimension * (i+1)],
-            h
-        )
-    )
-    lbg += [0] * state_dimension
-    ubg += [0] * state_dimension
+# number of shooting constraint rows, including the lifted RK4 stages
+n_shooting = (5 if lifted_rk4 else 1) * N * state_dimension
+
+# number of constraint rows: initial value, shooting, surface,
+# change of thrust and angle, terminal
+n_constraints = state_dimension + n_shooting + N + 2 * (N - 1) + 3
 
-# contraint: stay above the surface (eqn. (24))
-for i in range(0, N):
-    x_current = x[i * state_dimension:(i+1) * state_dimension]
-    constraints.append(ca.norm_2(x_current[0:dimension]))
-    lbg += [1.1 * surface]
-    ubg += [ca.inf]
+lbg = np.empty(n_constraints)
+ubg = np.empty(n_constraints)
+offset = 0
 
-# constraint: 0 <= u_k1 = r_k <= thrust_max (eqn. (23))
-constraints.append(u[::dimension])
-lbg += [0] * N
-ubg += [thrust_max] * N
+# constraint: x_0 = x_0_bar (eqn. (27))
+constraints.append(x[0:state_dimension] - x_0_bar)
+lbg[offset:offset + state_dimension] = 0
+ubg[offset:offset + state_dimension] = 0
+offset += state_dimension
+
+# contraint: x_k+1 - F(x_k, u_k) (eqn. (26)), evaluated for all k at once
+X = ca.reshape(x, state_dimension, N + 1)
+U = ca.reshape(u, dimension, N)
+
+if lifted_rk4:
+    # the stages are determined by additional equality constraints, so every
+    # row only couples the variables of a single interval
+    K = ca.reshape(k, 4 * state_dimension, N)
+
+    K1 = K[0:state_dimension, :]
+    K2 = K[state_dimension:2 * state_dimension, :]
+    K3 = K[2 * state_dimension:3 * state_dimension, :]
+    K4 = K[3 * state_dimension:4 * state_dimension, :]
+
+    constraints.append(ca.reshape(ca.vertcat(
+        K1 - ode_map(X[:, :-1], U),
+        K2 - ode_map(X[:, :-1] + h * 0.5 * K1, U),
+        K3 - ode_map(X[:, :-1] + h * 0.5 * K2, U),
+        K4 - ode_map(X[:, :-1] + h * K3, U),
+        X[:, 1:] - X[:, :-1] - (h / 6) * (K1 + 2 * K2 + 2 * K3 + K4)
+    ), -1, 1))
+else:
+    constraints.append(ca.reshape(X[:, 1:] - dynamics_map(X[:, :-1], U, h),
+                                  -1, 1))
+lbg[offset:offset + n_shooting] = 0
+ubg[offset:offset + n_shooting] = 0
+offset += n_shooting
+
+# contraint: stay above the surface (eqn. (24)), squared to avoid
+# the square root of the norm, evaluated for all k at once
+constraints.append(ca.sum1(X[0:dimension, :N] ** 2).T)
+lbg[offset:offset + N] = (1.1 * surface) ** 2
+ubg[offset:offset + N] = ca.inf
+offset += N
+
+# constraint: 0 <= u_k1 = r_k <= thrust_max (eqn. (23)), passed to the solver
+# as simple bounds on the decision variables
+lbx = np.full((N + 1) * state_dimension + N * dimension + n_stages, -ca.inf)
+ubx = np.full((N + 1) * state_dimension + N * dimension + n_stages, ca.inf)
+lbx[(N + 1) * state_dimension:
+    (N + 1) * state_dimension + N * dimension:dimension] = 0
+ubx[(N + 1) * state_dimension:
+    (N + 1) * state_dimension + N * dimension:dimension] = thrust_max
 
 # constant: limit change of thrust (eqn. (31))
-for i in range(N-1):
-    constraints.append(ca.fabs(u[(i+1) * dimension] - u[i * dimension]))
-    lbg += [0]
-    ubg += [h * thrust_max / 60]
+constraints.append((U[0, 1:] - U[0, :-1]).T)
+lbg[offset:offset + N - 1] = -h * thrust_max / 60
+ubg[offset:offset + N - 1] = h * thrust_max / 60
+offset += N - 1
 
 # contraint: limit change of angle (eqn. (32))
-for i in range(N-1):
-    constraints.append(ca.fabs(u[(i + 1) * dimension + 1]
-                               - u[i * dimension + 1]))
-    lbg += [0]
-    ubg += [h * pi / 48]
+constraints.append((U[1, 1:] - U[1, :-1]).T)
+lbg[offset:offset + N - 1] = -h * pi / 48
+ubg[offset:offset + N - 1] = h * pi / 48
+offset += N - 1
 
 # Terminal constraints:
 x_terminal = x[N * state_dimension:(N+1) * state_dimension]
 
-# constraint: reach orbital velocity (eqn. (16))
+# constraint: reach orbital velocity (eqn. (16)), squared
 constraints.append(
-    ca.norm_2(x_terminal[n_body * dimension:(n_body + 1)
-                         * dimension]) - orbital_vel
+    ca.sumsqr(x_terminal[n_body * dimension:(n_body + 1)
+                         * dimension]) - orbital_vel ** 2
 )
-lbg += [0]
-ubg += [0]
+lbg[offset] = 0
+ubg[offset] = 0
+offset += 1
 
 # constraint: velocity is perpendicular to orbit normal (eqn. (17))
 constraints.append(
     ca.dot(x_terminal[n_body * dimension:(n_body + 1) * dimension],
            x_terminal[0:dimension])
 )
-lbg += [0]
-ubg += [0]
+lbg[offset] = 0
+ubg[offset] = 0
+offset += 1
 
-# constraint: rocket has correct distance to the planet (eqn. (15))
+# constraint: rocket has correct distance to the planet (eqn. (15)), squared
 constraints.append(
-    ca.norm_2(x_terminal[0:dimension]) - orbit
+    ca.sumsqr(x_terminal[0:dimension]) - orbit ** 2
 )
-lbg += [0]
-ubg += [0]
-
+lbg[offset] = 0
+ubg[offset] = 0
+offset += 1
 
-constraints = ca.vertcat(*constraints)
-
-J_constraint_expr = ca.jacobian(constraints, ca.vertcat(x, u))
-J_constraint = ca.Function("JC", [ca.vertcat(x, u)], [J_constraint_expr])
+# every constraint row has received its bounds
+assert offset == n_constraints
 
-nlp = {'x': ca.vertcat(x, u), 'f': cost_function_integral_discrete(x, u),
-       'g': constraints}
 
-solver = ca.nlpsol('solver', 'ipopt', nlp)
-
-# build initial guess
-v_initial = sqrt(0.3 ** 2 + 3 ** 2)
-x_initial = [surface, 0, v_initial * cos(pi/3), v_initial * sin(pi/3)]
-u_initial = [0] * (2 * N)
+constraints = ca.vertcat(*constraints)
 
-# simultate the initial trajectory using u_initial
-for i in range(N):
-    x_initial = np.concatenate(
-        (
-            x_initial, dynamics(x_initial[i*state_dimension:(i + 1)
-                                          * state_dimension],
-                                u_initial[dimension*i:dimension*(i+1)],
-                                h).full().flatten()
+# share common subexpressions of the cost and the constraints (e.g. the
+# slices of the terminal state) before the NLP is differentiated
+nlp = {'x': ca.vertcat(x, u, k),
+       'f': ca.cse(cost_function_integral_discrete(x, u)),
+       'g': ca.cse(constraints)}
+
+# expand the MX graph to SX before the NLP functions are compiled
+solver_options = {
+    'expand': True,
+    'print_time': False,
+    'ipopt': {
+        'tol': 1e-4,
+        'max_iter': 3000,
+        # stop early if the iterates stall close to the tolerance
+        'acceptable_tol': 1e-3,
+        'acceptable_iter': 5,
+        'hessian_approximation': 'limited-memory',
+        # the barrier parameter is updated adaptively, with monotone updates
+        # IPOPT needs about four times as many iterations
+        'mu_strategy': 'adaptive',
+        # use the HSL solvers if IPOPT can load them, MUMPS otherwise
+        'linear_solver': linear_solver(nlp['x'].shape[0]),
+        'mumps_mem_percent': 5000,
+        # cold start from the simulated initial guess (see use_warm_start)
+        'warm_start_init_point': 'no',
+        'print_level': 0,
+    },
+}
+
+# solve with the IPOPT interface of CasADi ('casadi') or through cyipopt
+# ('cyipopt'), which hands the sparsity patterns to IPOPT directly
+solver_backend = 'casadi'
+
+# store the solution of every converged run and start the next run of the
+# same problem (functions and bounds) from it instead of the simulated
+# initial guess. Off by default, the result then depends on earlier runs
+use_warm_start = False
+
+warm_start_file = os.path.join(codegen.cache_dir, 'warm_start_2d.npz')
+
+if __name__ == "__main__":
+    # plotting is only needed when the script is run, importing it
+    # only builds the NLP
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+
+    warm_start = None
+
+    if use_warm_start:
+        problem = problem_digest(nlp, lbx, ubx, lbg, ubg)
+        warm_start = load_warm_start(warm_start_file, problem)
+
+    if warm_start is not None:
+        solver_options['ipopt'].update({
+            'warm_start_init_point': 'yes',
+            'warm_start_bound_push': 1e-8,
+            'warm_start_mult_bound_push': 1e-8,
+        })
+
+    if solver_backend == 'casadi':
+        # the NLP functions (objective, constraints and their derivatives) are
+        # compiled to native code once and reused by later runs
+        solver = codegen.cached_nlpsol('solver_2d', 'ipopt', nlp,
+                                       solver_options)
+
+    # build initial guess
+    v_initial = sqrt(0.3 ** 2 + 3 ** 2)
+
+    # the simulated states and the controls are written directly into views of
+    # the preallocated initial guess
+    initial_guess = np.zeros((N + 1) * state_dimension + N * dimension
+                             + n_stages)
+    x_initial = initial_guess[:(N + 1) * state_dimension].reshape(
+        N + 1, state_dimension)
+    u_initial = initial_guess[(N + 1) * state_dimension:
+                              (N + 1) * state_dimension
+                              + N * dimension].reshape(N, dimension)
+    k_initial = initial_guess[(N + 1) * state_dimension
+                              + N * dimension:].reshape(N, n_stages // N)
+
+    x_initial[0] = [surface, 0, v_initial * cos(pi/3), v_initial * sin(pi/3)]
+
+    # simultate the initial trajectory using u_initial
+    rollout_np(x_initial, u_initial, h)
+
+    # the RK4 stages of the simulated trajectory
+    if lifted_rk4:
+        k1 = ode_map(x_initial[:-1].T, u_initial.T).full()
+        k2 = ode_map(x_initial[:-1].T + h * 0.5 * k1, u_initial.T).full()
+        k3 = ode_map(x_initial[:-1].T + h * 0.5 * k2, u_initial.T).full()
+        k4 = ode_map(x_initial[:-1].T + h * k3, u_initial.T).full()
+        k_initial[:] = np.vstack([k1, k2, k3, k4]).T
+
+    # start from the previous solution and its multipliers if available
+    if warm_start is None:
+        x0, lam_g0, lam_x0 = initial_guess, 0, 0
+    else:
+        x0 = warm_start['x']
+        lam_g0 = warm_start['lam_g']
+        lam_x0 = warm_start['lam_x']
+
+    # Solve the NLP
+    if solver_backend == 'casadi':
+        res = solver(
+            x0=x0,    # solution guess
+            lam_g0=lam_g0,    # multipliers of g
+            lam_x0=lam_x0,    # multipliers of the bounds on x
+            lbx=lbx,              # lower bound on x
+            ubx=ubx,              # upper bound on x
+            lbg=lbg,                # lower bound on g
+            ubg=ubg,                # upper bound on g
         )
+        success = solver.stats()['success']
+    else:
+        res = cyipopt_nlp.solve(nlp, x0, lbx, ubx, lbg, ubg,
+                                solver_options['ipopt'], lam_g0, lam_x0)
+        success = res['success']
+
+    if use_warm_start and success:
+        save_warm_start(warm_start_file, res, problem)
+
+    optimal_variables = res["x"].full()
+
+    # terminal simulation time horizon
+    terminal_sim = 210
+
+    # get the optimal trajectory of the orbiting body, followed by the
+    # terminal simulation
+    optimal_trajectory = np.empty((N + 1 + terminal_sim, state_dimension))
+    optimal_trajectory[:N + 1] = np.reshape(
+        optimal_variables[:(N + 1) * state_dimension],
+        (N + 1, state_dimension)
     )
 
-# construct the initial guess
-initial_guess = np.concatenate((x_initial, u_initial)).tolist()
-
-
-# Solve the NLP
-res = solver(
-    x0=initial_guess,    # solution guess
-    lbx=-ca.inf,          # lower bound on x
-    ubx=ca.inf,           # upper bound on x
-    lbg=lbg,                # lower bound on g
-    ubg=ubg,                # upper bound on g
-)
+    # get the optimal controls of the orbiting body, followed by zero controls
+    # for the terminal simulation (after the body has reached a stable orbit
+    # and no further controls are nessecary)
+    optimal_controls = np.zeros((N + 1 + terminal_sim, 2))
+    optimal_controls[:N] = np.reshape(
+        optimal_variables[(N + 1) * state_dimension:
+                          (N + 1) * state_dimension + N * dimension],
+        (N, 2))
+
+    # the terminal simulation continues from the last optimal state and is
+    # written directly into the trajectory, the unactuated orbit is
+    # simulated numerically without CasADi
+    rollout_np(optimal_trajectory[N:], optimal_controls[N:N + terminal_sim], h)
+
+    # create a visual plot:
+    fig = plt.figure()
+    ax = fig.add_subplot()
+
+    lines = []
+    dots = []
+    objects = []
+
+    fig3 = plt.figure()
+    ax3 = fig3.add_subplot()
+
+    fig2 = plt.figure()
+    axp = fig2.add_subplot(polar=True)
+
+    # a rescale factor for the visual control vector in the plot
+    vrf = 80 / thrust_max
+
+    # add animated control vector
+    vector = ax.annotate("", xytext=(optimal_trajectory[0, 0 * dimension],
+                                     optimal_trajectory[0, 0 * dimension + 1]),
+                         xy=(
+                                 optimal_trajectory[0, 0 * dimension] + vrf
+                                 * optimal_controls[0, 0]
+                                 * cos(optimal_controls[0, 1]),
+                                 optimal_trajectory[0, 0 * dimension + 1] + vrf
+                                 * optimal_controls[0, 0]
+                                 * sin(optimal_controls[0, 1])),
+                         arrowprops={"facecolor": "red"})
+
+    objects.append(vector)
 
-optimal_variables = res["x"].full()
-
-# The contraint jacobian has full rank:
-# print(np.linalg.matrix_rank(J_constraint(optimal_variables)))
-# print(J_constraint(optimal_variables).shape)
-
-# get the optimal trajectory of the orbiting body
-optimal_trajectory = np.reshape(
-    optimal_variables[:(N + 1) * state_dimension],
-    (N + 1, state_dimension)
-)[:, 0:4]
-
-# get the optimal controls of the orbiting body
-optimal_controls = np.reshape(
-    optimal_variables[(N + 1) * state_dimension:],
-    (N, 2))
-
-# add a zero control to u for the terminal simulation (after the body has
-# reached a stable orbit and no further controls are nessecary)
-optimal_controls = np.vstack([optimal_controls, np.array([0, 0])])
-
-# terminal simulation time horizon
-terminal_sim = 210
-
-# append the terminal simulation to the optimal trajectory
-for i in range(N, N+terminal_sim):
-    optimal_trajectory = np.vstack([optimal_trajectory,
-                                    dynamics(optimal_trajectory[i, :],
-                                             [0] * 2, h).full().flatten()])
-    optimal_controls = np.vstack([optimal_controls, np.array([0, 0])])
-
-
-# create a visual plot:
-fig = plt.figure()
-ax = fig.add_subplot()
-
-lines = []
-dots = []
-objects = []
-
-fig3 = plt.figure()
-ax3 = fig3.add_subplot()
-
-fig2 = plt.figure()
-axp = fig2.add_subplot(polar=True)
-
-# a rescale factor for the visual control vector in the plot
-vrf = 80 / thrust_max
-
-# add animated control vector
-vector = ax.annotate("", xytext=(optimal_trajectory[0, 0 * dimension],
-                                 optimal_trajectory[0, 0 * dimension + 1]),
-                     xy=(
-                             optimal_trajectory[0, 0 * dimension] + vrf
-                             * optimal_controls[0, 0]
-                             * cos(optimal_controls[0, 1]),
-                             optimal_trajectory[0, 0 * dimension + 1] + vrf
-                             * optimal_controls[0, 0]
-                             * sin(optimal_controls[0, 1])),
-                     arrowprops={"facecolor": "red"})
-
-objects.append(vector)
-
-for b_index in range(n_body):
-    line, = ax.plot(optimal_trajectory[:, b_index * dimension],
-                    optimal_trajectory[:, b_index * dimension + 1],
-                    '--', alpha=0.6)
-    dot, = ax.plot(optimal_trajectory[0, b_index * dimension],
-                   optimal_trajectory[0, b_index * dimension + 1],
-                   'bo', alpha=1)
-    dots.append(dot)
-    lines.append(line)
-    objects.append(line)
-    objects.append(dot)
-
-
-def update(num, optimal_trajectory, objects):
-    objects[0].xy = (
-                     optimal_trajectory[num, 0 * dimension] + vrf
-                     * optimal_controls[num, 0]
-                     * cos(optimal_controls[num, 1]),
-                     optimal_trajectory[num, 0 * dimension + 1] + vrf
-                     * optimal_controls[num, 0]
-                     * sin(optimal_controls[num, 1])
-    )
+    for b_index in range(n_body):
+        line, = ax.plot(optimal_trajectory[:, b_index * dimension],
+                        optimal_trajectory[:, b_index * dimension + 1],
+                        '--', alpha=0.6)
+        dot, = ax.plot(optimal_trajectory[0, b_index * dimension],
+                       optimal_trajectory[0, b_index * dimension + 1],
+                       'bo', alpha=1)
+        dots.append(dot)
+        lines.append(line)
+        objects.append(line)
+        objects.append(dot)
+
+    # contiguous copies of the coordinates of each body, the animation only
+    # takes views of these instead of slicing the strided columns of the
+    # trajectory
+    trajectory_xs = [optimal_trajectory[:, b_index * dimension].copy()
+                     for b_index in range(n_body)]
+    trajectory_ys = [optimal_trajectory[:, b_index * dimension + 1].copy()
+                     for b_index in range(n_body)]
+
+    def update(num, optimal_trajectory, objects):
+        objects[0].xy = (
+                         optimal_trajectory[num, 0 * dimension] + vrf
+                         * optimal_controls[num, 0]
+                         * cos(optimal_controls[num, 1]),
+                         optimal_trajectory[num, 0 * dimension + 1] + vrf
+                         * optimal_controls[num, 0]
+                         * sin(optimal_controls[num, 1])
+        )
 
-    objects[0].set_position(
-            (optimal_trajectory[num, 0 * dimension],
-             optimal_trajectory[num, 0 * dimension + 1])
-    )
+        objects[0].set_position(
+                (optimal_trajectory[num, 0 * dimension],
+                 optimal_trajectory[num, 0 * dimension + 1])
+        )
 
-    for b_index in range(n_body):
-        objects[1 + 2 * b_index].set_data(optimal_trajectory[0:num, b_index
-                                                             * dimension],
-                                          optimal_trajectory[0:num, b_index
-                                                             * dimension + 1])
-        objects[1 + 2 * b_index + 1].set_data(optimal_trajectory[num, b_index
-                                                                 * dimension],
-                                              optimal_trajectory[num, b_index
-                                                                 * dimension
-                                                                 + 1])
-    return objects
-
-
-def update_polar(num):
-    polar_line.set_data(optimal_control_vector[1::2][:num],
-                        np.abs(optimal_control_vector[0::2][:num])
-                        / thrust_max)
-    return [polar_line]
-
-
-optimal_control_vector = optimal_variables[(N + 1) * state_dimension:]
-ax3.plot(np.linspace(0, T, num=optimal_control_vector.shape[0]//2),
-         ca.fabs(optimal_control_vector[::2])/thrust_max, "--x")
-ax3.set_ylim([0, 1.1])
-ax3.plot([0, T], [1, 1], "--", color="black")
-ax3.set_title("Thrust over time")
-ax3.set_xlabel("Time")
-ax3.set_ylabel(r"$r(t) / r_{\max}$")
-
-
-polar_line, = axp.plot(optimal_control_vector[1::2],
-                       np.abs(optimal_control_vector[0::2]) / thrust_max, "-")
-axp.set_ylim([0, 1.1])
-axp.set_theta_zero_location("E")
-axp.set_title("Polar plot of the controls")
-
-circle = plt.Circle((0, 0), 190, fill=False, alpha=0.03)
-ax.add_patch(circle)
-
-circle = plt.Circle((0, 0), 100, fill=True)
-ax.add_patch(circle)
-
-ax.set_aspect('equal', adjustable='box')
-ax.set_title("Rocket Trajectory")
-
-ani = animation.FuncAnimation(fig, update,
-                              fargs=[optimal_trajectory, objects],
-                              interval=N // 5, blit=True,
-                              frames=optimal_trajectory.shape[0])
-
-ani2 = animation.FuncAnimation(fig2, update_polar,
-                               interval=N // 5, blit=True,
-                               frames=optimal_trajectory.shape[0])
-
-plt.show()
+        for b_index in range(n_body):
+            xs = trajectory_xs[b_index]
+            ys = trajectory_ys[b_index]
+            objects[1 + 2 * b_index].set_data(xs[0:num], ys[0:num])
+            objects[1 + 2 * b_index + 1].set_data(xs[num:num + 1],
+                                                  ys[num:num + 1])
+        return objects
+
+    def update_polar(num):
+        polar_line.set_data(optimal_control_vector[1::2][:num],
+                            np.abs(optimal_control_vector[0::2][:num])
+                            / thrust_max)
+        return [polar_line]
+
+    optimal_control_vector = optimal_variables[(N + 1) * state_dimension:
+                                               (N + 1) * state_dimension
+                                               + N * dimension]
+    ax3.plot(np.linspace(0, T, num=optimal_control_vector.shape[0]//2),
+             ca.fabs(optimal_control_vector[::2])/thrust_max, "--x")
+    ax3.set_ylim([0, 1.1])
+    ax3.plot([0, T], [1, 1], "--", color="black")
+    ax3.set_title("Thrust over time")
+    ax3.set_xlabel("Time")
+    ax3.set_ylabel(r"$r(t) / r_{\max}$")
+
+    polar_line, = axp.plot(optimal_control_vector[1::2],
+                           np.abs(optimal_control_vector[0::2]) / thrust_max,
+                           "-")
+    axp.set_ylim([0, 1.1])
+    axp.set_theta_zero_location("E")
+    axp.set_title("Polar plot of the controls")
+
+    circle = plt.Circle((0, 0), 190, fill=False, alpha=0.03)
+    ax.add_patch(circle)
+
+    circle = plt.Circle((0, 0), 100, fill=True)
+    ax.add_patch(circle)
+
+    ax.set_aspect('equal', adjustable='box')
+    ax.set_title("Rocket Trajectory")
+
+    ani = animation.FuncAnimation(fig, update,
+                                  fargs=[optimal_trajectory, objects],
+                                  interval=N // 5, blit=True,
+                                  frames=optimal_trajectory.shape[0])
+
+    ani2 = animation.FuncAnimation(fig2, update_polar,
+                                   interval=N // 5, blit=True,
+                                   frames=optimal_trajectory.shape[0])
+
+    plt.show()